@@ -26,6 +26,7 @@ def user_item_pairs(
     user_item_filter_df=None,
     shuffle=True,
     seed=None,
+    engine="pandas",
 ):
     """Get all pairs of users and items data.
 
@@ -37,19 +38,50 @@ def user_item_pairs(
         user_item_filter_df (pd.DataFrame): User-item pairs to be used as a filter.
         shuffle (bool): If True, shuffles the result.
         seed (int): Random seed for shuffle
+        engine (str): Either "pandas" or "polars". With "polars", the cross join, filter and
+            shuffle run as multi-threaded polars joins, which requires polars and pyarrow to be
+            installed. The shuffled order differs from the one of "pandas" for the same seed.
 
     Returns:
         pd.DataFrame: All pairs of user-item from user_df and item_df, excepting the pairs in user_item_filter_df
     """
 
-    # Get all user-item pairs
-    user_df["key"] = 1
-    item_df["key"] = 1
-    users_items = user_df.merge(item_df, on="key")
+    if engine == "polars":
+        return _user_item_pairs_polars(
+            user_df, item_df, user_col, item_col, user_item_filter_df, shuffle, seed
+        )
+    if engine != "pandas":
+        raise ValueError("engine should be either 'pandas' or 'polars'.")
+
+    # Use categorical ids while building the pairs, so that string ids are stored as
+    # integer codes rather than repeated for every pair. The dtype is restored at the end.
+    id_dtypes = {}
+    if user_df[user_col].dtype == object:
+        id_dtypes[user_col] = user_df[user_col].dtype
+        user_df = user_df.assign(**{user_col: user_df[user_col].astype("category")})
+    if item_df[item_col].dtype == object:
+        id_dtypes[item_col] = item_df[item_col].dtype
+        item_df = item_df.assign(**{item_col: item_df[item_col].astype("category")})
 
-    user_df.drop("key", axis=1, inplace=True)
-    item_df.drop("key", axis=1, inplace=True)
-    users_items.drop("key", axis=1, inplace=True)
+    # Get all user-item pairs
+    if len(user_df.columns) == 1 and len(item_df.columns) == 1:
+        users_items = pd.MultiIndex.from_product(
+            [user_df[user_col], item_df[item_col]], names=[user_col, item_col]
+        ).to_frame(index=False)
+    else:
+        user_df, item_df = _suffix_overlapping_columns(user_df, item_df)
+        n_users, n_items = len(user_df), len(item_df)
+        users_items = pd.concat(
+            [
+                user_df.iloc[np.repeat(np.arange(n_users), n_items)].reset_index(
+                    drop=True
+                ),
+                item_df.iloc[np.tile(np.arange(n_items), n_users)].reset_index(
+                    drop=True
+                ),
+            ],
+            axis=1,
+        )
 
     # Filter
     if user_item_filter_df is not None:
@@ -60,9 +92,58 @@ def user_item_pairs(
             drop=True
         )
 
+    for col, dtype in id_dtypes.items():
+        users_items[col] = users_items[col].astype(dtype)
+
     return users_items
 
 
+def _user_item_pairs_polars(
+    user_df, item_df, user_col, item_col, user_item_filter_df, shuffle, seed
+):
+    """Get all pairs of users and items data with polars. See user_item_pairs for the arguments.
+
+    Returns:
+        pd.DataFrame: All pairs of user-item from user_df and item_df, excepting the pairs in user_item_filter_df
+    """
+    import polars as pl
+
+    user_df, item_df = _suffix_overlapping_columns(user_df, item_df)
+    users_items = pl.from_pandas(user_df, rechunk=False).join(
+        pl.from_pandas(item_df, rechunk=False), how="cross"
+    )
+
+    if user_item_filter_df is not None:
+        filter_df = pl.from_pandas(
+            user_item_filter_df[[user_col, item_col]], rechunk=False
+        ).cast(
+            {
+                user_col: users_items.schema[user_col],
+                item_col: users_items.schema[item_col],
+            }
+        )
+        users_items = users_items.join(filter_df, on=[user_col, item_col], how="anti")
+
+    if shuffle:
+        users_items = users_items.sample(fraction=1.0, shuffle=True, seed=seed)
+
+    return users_items.to_pandas()
+
+
+def _suffix_overlapping_columns(user_df, item_df):
+    """Suffix the columns found in both users and items data with _x and _y, as a merge
+    of them would.
+
+    Returns:
+        pd.DataFrame, pd.DataFrame: Users and items data with suffixed columns
+    """
+    overlap = user_df.columns.intersection(item_df.columns)
+    if len(overlap) > 0:
+        user_df = user_df.rename(columns={col: "{}_x".format(col) for col in overlap})
+        item_df = item_df.rename(columns={col: "{}_y".format(col) for col in overlap})
+    return user_df, item_df
+
+
 def filter_by(df, filter_by_df, filter_by_cols):
     """From the input DataFrame (df), remove the records whose target column (filter_by_cols) values are
     exist in the filter-by DataFrame (filter_by_df)
@@ -76,11 +157,49 @@ def filter_by(df, filter_by_df, filter_by_cols):
         pd.DataFrame: Dataframe filtered by filter_by_df on filter_by_cols
     """
 
-    return df.loc[
-        ~df.set_index(filter_by_cols).index.isin(
-            filter_by_df.set_index(filter_by_cols).index
-        )
-    ]
+    # Look up the records in the filter-by values with a hash table probe (get_indexer),
+    # where -1 means not found. Multiple columns are combined one by one into a single
+    # integer key, which is re-indexed by the filter-by keys to keep it small.
+    keys = None
+    for col in filter_by_cols:
+        values = pd.Index(filter_by_df[col].unique())
+        codes = values.get_indexer(df[col].values)
+        filter_by_codes = values.get_indexer(filter_by_df[col].values)
+        if keys is None:
+            keys, filter_by_keys = codes, filter_by_codes
+        else:
+            keys = np.where((keys >= 0) & (codes >= 0), keys * len(values) + codes, -1)
+            filter_by_keys = filter_by_keys * len(values) + filter_by_codes
+            filter_by_values = pd.Index(pd.unique(filter_by_keys))
+            keys = filter_by_values.get_indexer(keys)
+            filter_by_keys = filter_by_values.get_indexer(filter_by_keys)
+
+    return df.loc[keys == -1]
+
+
+def _factorize_with_missing(values):
+    """Encode values as codes in the order they first appear, with missing values encoded
+    as a value of their own rather than as -1.
+
+    Args:
+        values (pd.Series): Values to encode.
+
+    Returns:
+        np.array, int, int: Codes of the values, number of distinct values, and code of
+        the missing values (None if there is no missing value).
+    """
+    codes, uniques = pd.factorize(values)
+    missing = codes < 0
+    if not missing.any():
+        return codes, len(uniques), None
+
+    # Values first appearing before the first missing value keep their codes, and the
+    # ones after are shifted to make room for the missing values.
+    first_missing = missing.argmax()
+    missing_code = codes[:first_missing].max() + 1 if first_missing > 0 else 0
+    codes = np.where(codes >= missing_code, codes + 1, codes)
+    codes[missing] = missing_code
+    return codes, len(uniques) + 1, missing_code
 
 
 class LibffmConverter:
@@ -105,6 +224,8 @@ class LibffmConverter:
         actual numerical variable of the feature value in the field, respectively.
         3. If there are ordinal variables represented in int types, users should make sure these columns
         are properly converted to string type.
+        4. Missing values of a categorical field, i.e. None and NaN alike, are indexed as a single feature
+        of the field, i.e. `<field_index>:<field_feature_index>:nan`.
 
         The above data will be converted to the libffm format by following the convention as explained in
         `this paper <https://www.csie.ntu.edu.tw/~r01922136/slides/ffm.pdf>`_.
@@ -160,13 +281,8 @@ class LibffmConverter:
         """
 
         # Check column types.
-        types = df.dtypes
-        if not all(
-            [
-                x == object or np.issubdtype(x, np.integer) or x == np.float
-                for x in types
-            ]
-        ):
+        kinds = df.dtypes.map(lambda x: x.kind if isinstance(x, np.dtype) else None)
+        if not kinds.isin(["O", "i", "u", "f"]).all():
             raise TypeError("Input columns should be only object and/or numeric types.")
 
         if col_rating not in df.columns:
@@ -201,38 +317,37 @@ class LibffmConverter:
                 "Not all columns in the input dataset appear in the fitting dataset"
             )
 
-        # Encode field-feature.
+        # Encode field-feature into new columns, with the rating column first.
+        # Features of a categorical field are indexed in the order they first appear,
+        # and formatted once to be shared by all the rows they appear in, while all the
+        # values of a numerical field share a single index.
+        columns = [df[self.col_rating].copy()]
         idx = 1
-        self.field_feature_dict = {}
-        for field in self.field_names:
-            for feature in df[field].values:
-                # Check whether (field, feature) tuple exists in the dict or not.
-                # If not, put them into the key-values of the dict and count the index.
-                if (field, feature) not in self.field_feature_dict:
-                    self.field_feature_dict[(field, feature)] = idx
-                    if df[field].dtype == object:
-                        idx += 1
-            if df[field].dtype != object:
+        for field_index, field in enumerate(self.field_names, start=1):
+            feature = df[field]
+            if feature.dtype == object:
+                codes, n_features, missing_code = _factorize_with_missing(feature)
+                template = "{}:%d:1".format(field_index)
+                field_features = np.array(
+                    [template % i for i in range(idx, idx + n_features)], dtype=object
+                )
+                if missing_code is not None:
+                    field_features[missing_code] = "{}:{}:nan".format(
+                        field_index, idx + missing_code
+                    )
+                columns.append(
+                    pd.Series(field_features.take(codes), index=df.index, name=field)
+                )
+                idx += n_features
+            else:
+                columns.append("{}:{}:".format(field_index, idx) + feature.astype(str))
                 idx += 1
 
         self.field_count = len(self.field_names)
         self.feature_count = idx - 1
 
-        def _convert(field, feature, field_index, field_feature_index_dict):
-            field_feature_index = field_feature_index_dict[(field, feature)]
-            if isinstance(feature, str):                
-                feature = 1
-            return "{}:{}:{}".format(field_index, field_feature_index, feature)
-
-        for col_index, col in enumerate(self.field_names):
-            df[col] = df[col].apply(
-                lambda x: _convert(col, x, col_index + 1, self.field_feature_dict)
-            )
-
-        # Move rating column to the first.
-        column_names = self.field_names[:]
-        column_names.insert(0, self.col_rating)
-        df = df[column_names]
+        # Concatenate the new columns without consolidating them into a single block.
+        df = pd.concat(columns, axis=1, copy=False)
 
         if self.filepath is not None:
             np.savetxt(self.filepath, df.values, delimiter=" ", fmt="%s")
@@ -264,6 +379,79 @@ class LibffmConverter:
         }
 
 
+def _rank_within_groups(groups, n_groups):
+    """Rank the elements of each group, where the elements of a group are contiguous.
+
+    Args:
+        groups (np.ndarray): sorted group index of each element.
+        n_groups (int): number of groups.
+
+    Returns:
+        np.ndarray: position of each element within its group.
+    """
+    counts = np.bincount(groups, minlength=n_groups)
+    return np.arange(len(groups)) - (np.cumsum(counts) - counts)[groups]
+
+
+def _sample_negative_keys_by_enumeration(n_neg, pos_keys, n_items, random_state):
+    """Sample user-item keys without replacement among all negative pairs of the users.
+
+    Args:
+        n_neg (np.ndarray): number of negative keys to sample for each user.
+        pos_keys (np.ndarray): sorted unique keys of the positive user-item pairs.
+        n_items (int): number of items.
+        random_state (np.random.RandomState): random state used for sampling.
+
+    Returns:
+        np.ndarray: sampled negative keys.
+    """
+    users = np.flatnonzero(n_neg)
+    pos_keys = pos_keys[np.isin(pos_keys // n_items, users)]
+    is_neg = np.ones((len(users), n_items), dtype=bool)
+    is_neg[np.searchsorted(users, pos_keys // n_items), pos_keys % n_items] = False
+    rows, neg_items = np.nonzero(is_neg)
+    neg_users = users[rows]
+
+    # Negative pairs are grouped by user, so ranking them in a random order within each
+    # user and keeping the first ranks gives a random sample without replacement.
+    rank = _rank_within_groups(rows, len(users))
+    shuffled = np.argsort(rows + random_state.random_sample(len(rows)))
+    sampled = shuffled[rank < n_neg[neg_users]]
+    return neg_users[sampled] * n_items + neg_items[sampled]
+
+
+def _sample_negative_keys_by_rejection(n_neg, pos_keys, n_items, random_state):
+    """Sample user-item keys without replacement by drawing random items, and rejecting
+    positive and already drawn pairs until each user has enough negative keys.
+
+    Args:
+        n_neg (np.ndarray): number of negative keys to sample for each user.
+        pos_keys (np.ndarray): sorted unique keys of the positive user-item pairs.
+        n_items (int): number of items.
+        random_state (np.random.RandomState): random state used for sampling.
+
+    Returns:
+        np.ndarray: sampled negative keys.
+    """
+    n_users = len(n_neg)
+    neg_keys = np.empty(0, dtype=np.int64)
+    n_missing = n_neg
+    while n_missing.any():
+        # Draw twice as many items as missing, and keep the first valid ones per user.
+        n_draws = 2 * n_missing
+        candidates = np.repeat(np.arange(n_users, dtype=np.int64), n_draws) * n_items
+        candidates += random_state.randint(n_items, size=n_draws.sum())
+        candidates = candidates[~np.isin(candidates, pos_keys)]
+        keys = np.concatenate([neg_keys, candidates])
+        _, first = np.unique(keys, return_index=True)
+        keys = keys[np.sort(first)]
+        keys = keys[np.argsort(keys // n_items, kind="mergesort")]
+        key_users = keys // n_items
+        neg_keys = keys[_rank_within_groups(key_users, n_users) < n_neg[key_users]]
+        n_missing = n_neg - np.bincount(neg_keys // n_items, minlength=n_users)
+    return neg_keys
+
+
 def negative_feedback_sampler(
     df,
     col_user=DEFAULT_USER_COL,
@@ -316,50 +504,66 @@ def negative_feedback_sampler(
         3   3   1
         3   1   0
     """
-    # Get all of the users and items.
-    users = df[col_user].unique()
-    items = df[col_item].unique()
-
-    # Create a dataframe for all user-item pairs
-    df_neg = user_item_pairs(
-        pd.DataFrame(users, columns=[col_user]),
-        pd.DataFrame(items, columns=[col_item]),
-        user_item_filter_df=df,
+    # Drop the feedback with a missing user or item, which cannot be paired.
+    missing = df[col_user].isnull().values | df[col_item].isnull().values
+    if missing.any():
+        df = df.loc[~missing]
+
+    # Encode users and items, so that each user-item pair is a single integer key.
+    user_codes, users = pd.factorize(df[col_user], sort=True)
+    item_codes, items = pd.factorize(df[col_item], sort=True)
+    n_users, n_items = len(users), len(items)
+    keys = user_codes.astype(np.int64) * n_items + item_codes
+    pos_keys = np.unique(keys)
+
+    # Get the number of negative feedback of each user w.r.t. its positive feedback,
+    # capped by the number of items the user has not interacted with.
+    n_seen = np.bincount(pos_keys // n_items, minlength=n_users)
+    n_pos = np.bincount(user_codes, minlength=n_users)
+    n_neg = np.maximum(np.round(n_pos * ratio_neg_per_user), 1).astype(np.int64)
+    n_neg = np.minimum(n_neg, n_items - n_seen)
+
+    # Sample negative feedback.
+    # Random items are mostly negative for users who have interacted with, or need
+    # samples of, less than half of the items, so they are sampled by rejection without
+    # enumerating all of their pairs. The negative pairs of other users are enumerated.
+    random_state = np.random.RandomState(seed)
+    by_rejection = 2 * (n_seen + n_neg) <= n_items
+    neg_keys = np.sort(
+        np.concatenate(
+            [
+                _sample_negative_keys_by_rejection(
+                    np.where(by_rejection, n_neg, 0), pos_keys, n_items, random_state
+                ),
+                _sample_negative_keys_by_enumeration(
+                    np.where(by_rejection, 0, n_neg), pos_keys, n_items, random_state
+                ),
+            ]
+        )
+    )
+    neg_users, neg_items = np.divmod(neg_keys, n_items)
+
+    # Order the feedback by user, with the positive feedback of each user first.
+    # Negative keys are already sorted, so sorting the positive feedback by its keys
+    # makes two runs sorted by user, which a stable sort merges in linear time.
+    pos_order = np.argsort(keys, kind="mergesort")
+    order = np.argsort(
+        np.concatenate([user_codes[pos_order], neg_users]), kind="mergesort"
     )
-    df_neg[col_label] = 0
-
-    df_pos = df.copy()
-    df_pos[col_label] = 1
 
-    df_all = pd.concat([df_pos, df_neg], ignore_index=True, sort=True)
-    df_all = df_all[[col_user, col_item, col_label]]
+    df_neg = pd.DataFrame(
+        {
+            col_user: users.take(neg_users),
+            col_item: items.take(neg_items),
+            col_label: 0,
+        }
+    )
+    df_pos = df[[col_user, col_item]].take(pos_order).assign(**{col_label: 1})
 
-    # Sample negative feedback from the combined dataframe.
     df_sample = (
-        df_all.groupby(col_user)
-        .apply(
-            lambda x: pd.concat(
-                [
-                    x[x[col_label] == 1],
-                    x[x[col_label] == 0].sample(
-                        min(
-                            max(
-                                round(len(x[x[col_label] == 1]) * ratio_neg_per_user), 1
-                            ),
-                            len(x[x[col_label] == 0]),
-                        ),
-                        random_state=seed,
-                        replace=False,
-                    )
-                    if len(x[x[col_label] == 0] > 0)
-                    else pd.DataFrame({}, columns=[col_user, col_item, col_label]),
-                ],
-                ignore_index=True,
-                sort=True,
-            )
-        )
+        pd.concat([df_pos, df_neg], ignore_index=True, copy=False)
+        .take(order)
         .reset_index(drop=True)
-        .sort_values(col_user)
     )
 
     return df_sample
@@ -9,6 +9,7 @@ from reco_utils.dataset.pandas_df_utils import (
     user_item_pairs,
     filter_by,
     LibffmConverter,
+    negative_feedback_sampler,
     has_same_base_dtype,
     has_columns,
     lru_cache_df,
@@ -49,6 +50,32 @@ def test_user_item_pairs(user_item_dataset):
     # Check if result is deterministic
     assert user_item.iloc[0].values.tolist() == [1, 23, 6, [0.1, 0.1]]
 
+    # Check the input dataframes are not modified
+    assert user_df.columns.tolist() == ['user_id', 'user_age']
+    assert item_df.columns.tolist() == ['item_id', 'item_feat']
+
+    # Check cross-join of id-only dataframes
+    user_item_ids = user_item_pairs(
+        user_df=user_df[['user_id']],
+        item_df=item_df[['item_id']],
+        user_col='user_id',
+        item_col='item_id',
+        shuffle=False
+    )
+    assert user_item_ids.columns.tolist() == ['user_id', 'item_id']
+    assert user_item_ids.values.tolist() == user_item[['user_id', 'item_id']].values.tolist()
+
+    # Check columns in both dataframes are suffixed like a merge of them would
+    user_item_feat = user_item_pairs(
+        user_df=user_df.rename(columns={'user_age': 'feat'}),
+        item_df=item_df.rename(columns={'item_feat': 'feat'}),
+        user_col='user_id',
+        item_col='item_id',
+        shuffle=False
+    )
+    assert user_item_feat.columns.tolist() == ['user_id', 'feat_x', 'item_id', 'feat_y']
+    assert user_item_feat.values.tolist() == user_item.values.tolist()
+
     # Check shuffle
     user_item_shuffled = user_item_pairs(
         user_df=user_df,
@@ -83,6 +110,66 @@ def test_user_item_pairs(user_item_dataset):
     # Check filtered out record
     assert len(user_item_filtered.loc[(user_item['user_id'] == 3) & (user_item['item_id'] == 7)]) == 0
 
+    # Check string ids are filtered and returned as they are
+    user_item_str = user_item_pairs(
+        user_df=user_df.assign(user_id=user_df['user_id'].astype(str)),
+        item_df=item_df.assign(item_id=item_df['item_id'].astype(str)),
+        user_col='user_id',
+        item_col='item_id',
+        user_item_filter_df=seen_df.astype(str),
+        shuffle=False
+    )
+    assert user_item_str['user_id'].dtype == object
+    assert user_item_str['item_id'].dtype == object
+    assert user_item_str[['user_id', 'item_id']].values.tolist() == \
+        user_item_filtered[['user_id', 'item_id']].astype(str).values.tolist()
+
+
+def test_user_item_pairs_polars(user_item_dataset):
+    pytest.importorskip('polars')
+    pytest.importorskip('pyarrow')
+    user_df, item_df = user_item_dataset
+
+    seen_df = pd.DataFrame({
+        'user_id': [1, 9, 3, 5, 5, 1],
+        'item_id': [1, 6, 7, 6, 8, 9]
+    })
+    kwargs = dict(
+        user_df=user_df,
+        item_df=item_df,
+        user_col='user_id',
+        item_col='item_id',
+        user_item_filter_df=seen_df,
+    )
+    user_item = user_item_pairs(shuffle=False, **kwargs)
+    user_item_polars = user_item_pairs(shuffle=False, engine='polars', **kwargs)
+
+    # Check the result is the same as the pandas one
+    assert user_item_polars.columns.tolist() == user_item.columns.tolist()
+    assert user_item_polars[['user_id', 'user_age', 'item_id']].values.tolist() == \
+        user_item[['user_id', 'user_age', 'item_id']].values.tolist()
+
+    # Check shuffle
+    user_item_shuffled = user_item_pairs(shuffle=True, seed=42, engine='polars', **kwargs)
+    assert len(user_item_shuffled) == len(user_item)
+    assert user_item_shuffled['user_id'].tolist() != user_item['user_id'].tolist()
+    assert sorted(zip(user_item_shuffled['user_id'], user_item_shuffled['item_id'])) == \
+        sorted(zip(user_item['user_id'], user_item['item_id']))
+
+    # Check columns in both dataframes are suffixed like the pandas ones
+    feat_kwargs = dict(
+        user_df=user_df.rename(columns={'user_age': 'feat'}),
+        item_df=item_df.rename(columns={'item_feat': 'feat'}),
+        user_col='user_id',
+        item_col='item_id',
+        shuffle=False
+    )
+    assert user_item_pairs(engine='polars', **feat_kwargs).columns.tolist() == \
+        user_item_pairs(**feat_kwargs).columns.tolist() == ['user_id', 'feat_x', 'item_id', 'feat_y']
+
+    with pytest.raises(ValueError):
+        user_item_pairs(engine='spark', **kwargs)
+
 
 def test_filter_by():
     user_df = pd.DataFrame({
@@ -126,10 +213,17 @@ def test_csv_to_libffm():
         with pytest.raises(TypeError) as e:
             LibffmConverter().fit(df_feature_wrong_type)
             assert e.value == "Input columns should be only object and/or numeric types."
+        df_feature_wrong_type['field4'] = df_feature['field4'].astype('category')
+        with pytest.raises(TypeError):
+            LibffmConverter().fit(df_feature_wrong_type)
 
         # Check if the dim is the same.
         assert df_feature_libffm.shape == df_feature.shape
 
+        # Check the input dataframe is not modified.
+        assert df_feature['field1'].tolist() == ['xxx1', 'xxx2', 'xxx4', 'xxx4', 'xxx4']
+        assert df_feature['field2'].tolist() == [3, 4, 5, 6, 7]
+
         # Check if the columns are converted successfully.
         assert df_feature_libffm.iloc[0, :].values.tolist() == [1, '1:1:1', '2:4:3', '3:5:1.0', '4:6:1']
 
@@ -165,6 +259,74 @@ def test_csv_to_libffm():
         assert df_feature_new_libffm.iloc[0, :].values.tolist() == [1, '1:1:1', '2:5:3', '3:6:1.0', '4:7:1']
         assert df_feature_new_libffm.iloc[-1, :].values.tolist() == [1, '1:4:1', '2:5:8', '3:6:6.0', '4:12:1']
 
+    # Missing values of a categorical field, None and NaN alike, should be indexed as a
+    # single feature of their own.
+    df_feature_missing = pd.DataFrame({
+        'rating': [1, 0, 1, 0],
+        'field1': ['xxx1', np.nan, 'xxx2', None],
+        'field2': [1, 2, 3, 4]
+    })
+    converter = LibffmConverter().fit(df_feature_missing)
+    df_feature_missing_libffm = converter.transform(df_feature_missing)
+    assert df_feature_missing_libffm['field1'].tolist() == ['1:1:1', '1:2:nan', '1:3:1', '1:2:nan']
+    assert df_feature_missing_libffm['field2'].tolist() == ['2:4:1', '2:4:2', '2:4:3', '2:4:4']
+    assert converter.get_params()['feature count'] == 4
+
+
+def test_negative_feedback_sampler():
+    df = pd.DataFrame({
+        'userID': [1, 2, 3, 1, 4, 4, 4],
+        'itemID': [1, 2, 3, 4, 1, 2, 3],
+        'rating': [5, 5, 5, 5, 5, 5, 5]
+    })
+
+    df_neg_sampled = negative_feedback_sampler(
+        df, col_user='userID', col_item='itemID', col_label='feedback', ratio_neg_per_user=1
+    )
+
+    assert df_neg_sampled.columns.tolist() == ['userID', 'itemID', 'feedback']
+    # Check positive feedback is kept as is.
+    df_pos = df_neg_sampled[df_neg_sampled['feedback'] == 1]
+    assert sorted(zip(df_pos['userID'], df_pos['itemID'])) == sorted(zip(df['userID'], df['itemID']))
+    # Check negative feedback only contains unseen pairs.
+    df_neg = df_neg_sampled[df_neg_sampled['feedback'] == 0]
+    assert len(filter_by(df_neg, df, ['userID', 'itemID'])) == len(df_neg)
+    # Check number of negative samples per user, i.e. the ratio w.r.t. positive feedback
+    # capped by the number of available negative items.
+    assert df_neg.groupby('userID').size().to_dict() == {1: 2, 2: 1, 3: 1, 4: 1}
+    # Check the output is ordered by user, positive feedback first, then by item.
+    assert df_neg_sampled.index.tolist() == list(range(len(df_neg_sampled)))
+    assert df_neg_sampled.sort_values(
+        ['userID', 'feedback', 'itemID'], ascending=[True, False, True]
+    ).index.tolist() == df_neg_sampled.index.tolist()
+
+    # Check sampling is deterministic with a fixed seed.
+    df_neg_sampled_again = negative_feedback_sampler(
+        df, col_user='userID', col_item='itemID', col_label='feedback', ratio_neg_per_user=1
+    )
+    assert sorted(map(tuple, df_neg_sampled.values.tolist())) == sorted(
+        map(tuple, df_neg_sampled_again.values.tolist())
+    )
+
+    # Check the number of negative samples is capped by the number of unseen items.
+    df_neg_sampled = negative_feedback_sampler(
+        df, col_user='userID', col_item='itemID', col_label='feedback', ratio_neg_per_user=10
+    )
+    df_neg = df_neg_sampled[df_neg_sampled['feedback'] == 0]
+    assert df_neg.groupby('userID').size().to_dict() == {1: 2, 2: 3, 3: 3, 4: 1}
+
+    # Check the feedback with a missing user or item is dropped.
+    df_missing = pd.concat(
+        [df, pd.DataFrame({'userID': [np.nan, 5], 'itemID': [5, np.nan], 'rating': [5, 5]})],
+        ignore_index=True
+    )
+    df_neg_sampled_missing = negative_feedback_sampler(
+        df_missing, col_user='userID', col_item='itemID', col_label='feedback', ratio_neg_per_user=1
+    )
+    assert df_neg_sampled_missing[['userID', 'itemID']].notnull().values.all()
+    assert sorted(df_neg_sampled_missing['userID'].unique()) == [1, 2, 3, 4]
+    assert sorted(df_neg_sampled_missing['itemID'].unique()) == [1, 2, 3, 4]
+
 
 def test_has_columns():
     df_1 = pd.DataFrame(dict(a=[1, 2, 3]))